@@ -1,81 +1,205 @@
 import os
-import glob
-import pandas as pd
+import io
+import json
+import hashlib
+import pyarrow as pa
+import pyarrow.csv as pcsv
+import pyarrow.compute as pc
+import pyarrow.dataset as ds
 from datetime import datetime, timedelta
 import subprocess
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
 
-def is_git_tracked(filepath):
-    """Checks if a file is tracked by Git."""
+# Types of the columns the ESP32 firmware has written over time. Declaring them
+# up front skips type inference while parsing and gives every file the same
+# schema, so concatenating them needs no casts. The 'timestamp' column is
+# integer seconds, not a date string. Readings come from 12-bit ADCs and are
+# logged with at most a few decimals, so float32 holds them exactly as written
+# while halving the bytes moved through concat, sort and output. Unknown
+# columns are still inferred.
+COLUMN_TYPES = {
+    'date': pa.date32(),
+    'time': pa.time32('s'),
+    'timestamp': pa.int64(),
+    'temperature': pa.float32(),
+    'humidity': pa.float32(),
+    'gas_lpg_ppm': pa.float32(),
+    'gas_co_ppm': pa.float32(),
+    'gas_smoke_ppm': pa.float32(),
+    'air_quality_index': pa.float32(),
+    'gas_analog': pa.float32(),
+    'gas_digital': pa.int8(),
+    'ldr_lux': pa.float32(),
+    'light': pa.float32(),
+}
+CONVERT_OPTIONS = pcsv.ConvertOptions(column_types=COLUMN_TYPES)
+
+def skip_invalid_row(row):
+    """
+    Skips a CSV row with the wrong number of fields, such as a last line cut
+    off by a power loss on the ESP32, so the rest of its file is still merged.
+    """
+    print(f"Skipping malformed row (expected {row.expected_columns} fields, got {row.actual_columns}): {row.text}")
+    return 'skip'
+
+PARSE_OPTIONS = pcsv.ParseOptions(invalid_row_handler=skip_invalid_row)
+# Used when a file has a value that doesn't fit its declared type: known
+# columns are read as text first and converted afterwards, value by value
+LENIENT_CONVERT_OPTIONS = pcsv.ConvertOptions(column_types={name: pa.string() for name in COLUMN_TYPES},
+                                              strings_can_be_null=True)
+READ_OPTIONS = pcsv.ReadOptions(use_threads=True, block_size=8 << 20)
+
+COMBINED_CSV = 'data/sensor_data_combined.csv'
+COMBINED_PARQUET = 'data/combined_parquet'
+# The combined Parquet dataset keeps one directory per day (date=YYYY-MM-DD),
+# so a run only rewrites the days its new rows fall on
+PARTITIONING = ds.partitioning(pa.schema([('date', pa.date32())]), flavor='hive')
+MANIFEST_PATH = 'data/.merge_manifest.json'
+
+# Environment for every git call, built once. Optional locks are skipped so
+# read-only commands like status don't rewrite the index, git never waits on
+# a credential prompt in CI, and the C locale avoids locale-aware collation.
+GIT_ENV = {**os.environ, 'GIT_OPTIONAL_LOCKS': '0', 'GIT_TERMINAL_PROMPT': '0', 'LC_ALL': 'C'}
+
+@lru_cache(maxsize=None)
+def get_repo_root():
+    """Returns the top-level directory of the Git repository, or None if it can't be determined."""
     try:
-        subprocess.run(["git", "ls-files", "--error-unmatch", filepath],
-                       capture_output=True, check=True, cwd=os.path.dirname(filepath) or '.',
-                       text=True,
-                       timeout=10)
-        return True
-    except subprocess.CalledProcessError:
-        return False
+        result = subprocess.run(["git", "rev-parse", "--show-toplevel"], capture_output=True, text=True, check=True, env=GIT_ENV, timeout=10)
+        return result.stdout.strip()
+    except subprocess.CalledProcessError as e:
+        print(f"Warning: Could not determine Git repository root. Error: {e.stderr.strip()}")
     except FileNotFoundError:
         print("Error: 'git' command not found. Ensure Git is installed and in PATH.")
-        return False
     except subprocess.TimeoutExpired:
-        print(f"Timeout checking git tracking for {filepath}.")
-        return False
+        print("Timeout determining Git repository root.")
+    return None
+
+def get_git_tracked_files(directory):
+    """
+    Lists the files tracked by Git under 'directory' (relative to the repository
+    root) with a single `git ls-files` call. Returns a set of repository-relative
+    paths; the set is empty if an error occurs.
+    """
+    try:
+        result = subprocess.run(["git", "ls-files", "--", directory], capture_output=True, text=True, check=True, cwd=get_repo_root(), env=GIT_ENV, timeout=10)
+        return frozenset(result.stdout.splitlines())
+    except subprocess.CalledProcessError as e:
+        print(f"Git ls-files failed for {directory}: {e.stderr.strip()}")
+    except FileNotFoundError:
+        print("Error: 'git' command not found. Ensure Git is installed and in PATH.")
+    except subprocess.TimeoutExpired:
+        print(f"Timeout listing git tracked files in {directory}.")
+    return frozenset()
+
+def list_sensor_files(directory='data'):
+    """
+    Returns os.DirEntry objects for the sensor_*.csv files in 'directory', sorted
+    by path. A single directory scan with a name check replaces glob's pattern
+    matching, and each entry caches its stat() result for later use. The
+    combined CSV also matches the pattern but is an output, not a sensor file,
+    so it is left out; otherwise the cleanup could delete it.
+    """
+    combined_name = os.path.basename(COMBINED_CSV)
+    try:
+        with os.scandir(directory) as entries:
+            return sorted((e for e in entries
+                           if e.name.startswith('sensor_') and e.name.endswith('.csv') and e.name != combined_name),
+                          key=lambda e: e.path)
+    except FileNotFoundError:
+        return []
 
-def get_git_commit_time(filepath):
+def get_git_commit_times(directory):
     """
-    Gets the last commit time of a file from Git history.
-    Returns a datetime object or None if an error occurs.
+    Gets the last commit time of every file under 'directory' from a single
+    `git log` pass. Returns a dict mapping repository-relative paths to
+    datetime objects; the dict is empty if an error occurs.
     """
+    commit_times = {}
     try:
-        command = ["git", "log", "-1", "--format=%cd", "--date=iso-strict", "--", filepath]
-        result = subprocess.run(command, capture_output=True, text=True, check=True, cwd=os.path.dirname(filepath) or '.', timeout=10)
+        command = ["git", "log", "--name-only", "--format=%x00%cI", "--", directory]
+        result = subprocess.run(command, capture_output=True, text=True, check=True, cwd=get_repo_root(), env=GIT_ENV, timeout=60)
 
-        commit_time_str = result.stdout.strip()
-        if commit_time_str:
-            return datetime.fromisoformat(commit_time_str)
+        # Each record is a commit time followed by the paths it touched. The log
+        # is newest first, so the first time seen for a path is its latest commit.
+        for record in result.stdout.split("\0"):
+            lines = [line for line in record.splitlines() if line]
+            if not lines:
+                continue
+            # Convert to naive local time so it compares with filesystem mtimes
+            commit_time = datetime.fromisoformat(lines[0]).astimezone().replace(tzinfo=None)
+            for path in lines[1:]:
+                commit_times.setdefault(path, commit_time)
     except subprocess.CalledProcessError as e:
-        print(f"Git command failed for {filepath}: {e.stderr.strip()}")
+        print(f"Git log failed for {directory}: {e.stderr.strip()}")
     except ValueError as e:
-        print(f"Error parsing date for {filepath}: {e}")
+        print(f"Error parsing commit date in {directory}: {e}")
     except subprocess.TimeoutExpired:
-        print(f"Timeout getting git commit time for {filepath}.")
-    return None
+        print(f"Timeout getting git commit times for {directory}.")
+    return commit_times
+
+@lru_cache(maxsize=None)
+def get_git_state(directory):
+    """
+    Collects what the cleanup needs from Git about 'directory' (relative to the
+    repository root) with two subprocesses: the set of tracked files and each
+    file's last commit time. The repository root comes from get_repo_root,
+    which is cached separately because it is needed to locate 'directory'.
+    The result is cached, so later lookups in the same run are plain dict and
+    set accesses.
+    """
+    return {
+        'tracked': get_git_tracked_files(directory),
+        'commit_times': get_git_commit_times(directory),
+    }
 
 def cleanup_sensor_files_by_count(directory='data', files_to_keep=100):
     """
     Keeps only the newest 'files_to_keep' sensor data files and deletes all others.
     Recency is determined by Git commit time for tracked files, and filesystem
-    modification time for untracked files.
+    modification time for untracked files. Filesystem times alone can't be used:
+    a fresh checkout gives every file the same mtime, which is also why the
+    workflow checks out with full history.
     """
     file_info = [] # List to store (timestamp, filepath, source_of_timestamp) tuples
 
-    files = glob.glob(os.path.join(directory, 'sensor_*.csv'))
+    entries = list_sensor_files(directory)
+
+    # Nothing can be deleted, so skip ranking the files and every Git call
+    if len(entries) <= files_to_keep:
+        print(f"\n{len(entries)} sensor files found, no more than the {files_to_keep} to keep; nothing to delete.")
+        return
 
     original_cwd = os.getcwd()
     repo_root = None
     try:
         # Determine repository root
-        repo_root_process = subprocess.run(["git", "rev-parse", "--show-toplevel"], capture_output=True, text=True, check=False, timeout=10)
-        if repo_root_process.returncode == 0:
-            repo_root = repo_root_process.stdout.strip()
+        repo_root = get_repo_root()
+        if repo_root:
             os.chdir(repo_root)
             print(f"Changed current directory to Git repository root: {repo_root}")
         else:
-            print(f"Warning: Could not determine Git repository root. Git commands might fail or work relative to current dir. Error: {repo_root_process.stderr.strip()}")
+            print("Warning: Git commands might fail or work relative to current dir.")
             repo_root = original_cwd # Fallback
 
-        for file_path in files:
+        rel_directory = os.path.relpath(os.path.join(original_cwd, directory), repo_root)
+        git_state = get_git_state(rel_directory)
+
+        for entry in entries:
+            file_path = entry.path
             timestamp = None
             source = ""
             try:
                 # Try to get Git commit time first for tracked files
-                if repo_root and is_git_tracked(os.path.relpath(file_path, repo_root)):
-                    timestamp = get_git_commit_time(os.path.relpath(file_path, repo_root))
+                rel_path = os.path.relpath(os.path.join(original_cwd, file_path), repo_root)
+                if rel_path in git_state['tracked']:
+                    timestamp = git_state['commit_times'].get(rel_path)
                     source = "Git commit time"
 
                 # If not Git tracked or Git time failed, fall back to filesystem modification time
                 if not timestamp:
-                    timestamp = datetime.fromtimestamp(os.path.getmtime(file_path))
+                    timestamp = datetime.fromtimestamp(entry.stat().st_mtime)
                     source = "Filesystem modification time (untracked or Git lookup failed)"
 
                 if timestamp:
@@ -109,35 +233,337 @@ def cleanup_sensor_files_by_count(directory='data', files_to_keep=100):
         except Exception as e:
             print(f"Error deleting {fp}: {e}")
 
+def drop_duplicates(table):
+    """Returns the distinct rows of an Arrow table."""
+    return table.group_by(table.column_names).aggregate([])
+
+def values_differ(previous, current):
+    """
+    Compares two equal-length arrays element-wise and returns a boolean array
+    that is true where they differ. Two nulls are equal; a null and a value differ.
+    """
+    differs = pc.not_equal(previous, current)
+    return pc.if_else(pc.is_null(differs), pc.xor(pc.is_null(previous), pc.is_null(current)), differs)
+
+def sorted_distinct_indices(table):
+    """
+    Returns the indices of the distinct rows of an Arrow table, ordered by
+    timestamp. Sorting by timestamp and then by every other column places
+    duplicate rows next to each other, so a row is kept only if it differs
+    from the one before it. This deduplicates and sorts in one pass without
+    a hash table, and rows sharing a timestamp come out in a stable order.
+    """
+    # All-null columns can't be sorted on and never distinguish rows
+    keys = ['timestamp'] + [name for name in table.column_names
+                            if name != 'timestamp' and table.schema.field(name).type != pa.null()]
+    order = pc.sort_indices(table, sort_keys=[(name, 'ascending') for name in keys])
+    if len(order) < 2:
+        return order
+
+    # A row whose timestamp differs from its predecessor's is distinct, so the
+    # other columns only need comparing where the timestamp repeats. The
+    # timestamp alone is not a unique key (the device clock starts from zero
+    # again after a reboot without NTP), but repeats are rare.
+    timestamps = table['timestamp'].take(order)
+    differs = values_differ(timestamps[:-1], timestamps[1:]).combine_chunks()
+    repeated = pc.invert(differs)
+    repeats = pc.indices_nonzero(repeated)
+    if len(repeats):
+        previous_rows = order.take(repeats)
+        current_rows = order.take(pc.add(repeats, 1))
+        repeat_differs = pa.chunked_array([pa.array([False] * len(repeats))])
+        for name in keys[1:]:
+            column = table[name]
+            repeat_differs = pc.or_(repeat_differs, values_differ(column.take(previous_rows), column.take(current_rows)))
+        differs = pc.replace_with_mask(differs, repeated, repeat_differs.combine_chunks())
+    return order.filter(pa.concat_arrays([pa.array([True]), differs]))
+
+def coerce_column(column, column_type):
+    """Converts a string column to 'column_type', turning values that don't parse into nulls."""
+    if pa.types.is_time(column_type):
+        return pc.strptime(column, format='%H:%M:%S', unit='s', error_is_null=True).cast(column_type)
+    if pa.types.is_date(column_type):
+        return pc.strptime(column, format='%Y-%m-%d', unit='s', error_is_null=True).cast(column_type)
+    pattern = r'^\s*[-+]?\d+\s*$' if pa.types.is_integer(column_type) else \
+        r'^\s*[-+]?(\d+\.?\d*|\.\d+)([eE][-+]?\d+)?\s*$'
+    valid = pc.match_substring_regex(column, pattern)
+    return pc.if_else(valid, column, pa.scalar(None, pa.string())).cast(column_type)
+
+def read_sensor_file_lenient(filepath):
+    """
+    Reads a sensor CSV whose values don't all fit COLUMN_TYPES, storing the
+    values that don't as nulls so the rest of the file is kept.
+    """
+    table = pcsv.read_csv(filepath, read_options=READ_OPTIONS, parse_options=PARSE_OPTIONS,
+                          convert_options=LENIENT_CONVERT_OPTIONS)
+    for i, name in enumerate(table.column_names):
+        if name in COLUMN_TYPES:
+            column = coerce_column(table[name], COLUMN_TYPES[name])
+            invalid = column.null_count - table[name].null_count
+            if invalid:
+                print(f"Storing {invalid} invalid '{name}' values in {filepath} as null")
+            table = table.set_column(i, name, column)
+    return table
+
+def read_sensor_file(filepath):
+    """
+    Reads a sensor CSV into an Arrow table with duplicate rows already removed,
+    or returns None if it can't be parsed.
+    """
+    try:
+        try:
+            table = pcsv.read_csv(filepath, read_options=READ_OPTIONS, parse_options=PARSE_OPTIONS,
+                                  convert_options=CONVERT_OPTIONS)
+        except pa.ArrowInvalid as e:
+            if 'conversion error' not in str(e):
+                raise
+            print(f"Error converting {filepath}, reading it again with invalid values as null: {e}")
+            table = read_sensor_file_lenient(filepath)
+        return drop_duplicates(table)
+    except Exception as e:
+        print(f"Error reading {filepath}: {e}")
+        return None
+
+def read_header(filepath):
+    """Returns the header line of a CSV file, or None if it can't be read."""
+    try:
+        with open(filepath, 'rb') as f:
+            return f.readline().rstrip(b'\r\n')
+    except OSError as e:
+        print(f"Error reading {filepath}: {e}")
+        return None
+
+def read_sensor_group(files):
+    """
+    Reads sensor CSVs that share the same header into one Arrow table with
+    duplicate rows removed (None if none of them can be parsed), and returns
+    it with the list of files that were parsed. The files are appended byte
+    for byte under a single header so the CSV parser runs once for the whole
+    group. If that fails, the files are read one by one so a bad file only
+    drops itself.
+    """
+    try:
+        buffer = io.BytesIO()
+        for i, filepath in enumerate(files):
+            with open(filepath, 'rb') as f:
+                if i:
+                    f.readline() # Skip the repeated header
+                data = f.read()
+            buffer.write(data)
+            if data and not data.endswith(b'\n'):
+                buffer.write(b'\n')
+        table = pcsv.read_csv(pa.BufferReader(buffer.getvalue()), read_options=READ_OPTIONS,
+                              parse_options=PARSE_OPTIONS, convert_options=CONVERT_OPTIONS)
+        return drop_duplicates(table), files
+    except Exception as e:
+        print(f"Error reading {len(files)} files with a shared header, reading them individually: {e}")
+
+    tables, parsed_files = [], []
+    for filepath in files:
+        table = read_sensor_file(filepath)
+        if table is not None:
+            tables.append(table)
+            parsed_files.append(filepath)
+    if not tables:
+        return None, parsed_files
+    return drop_duplicates(pa.concat_tables(tables, promote_options="permissive")), parsed_files
+
+def sorted_batches(table, order, batch_rows=1 << 20):
+    """
+    Yields the rows of 'table', in the order given by the index array 'order',
+    as record batches. Rows are gathered one batch at a time, so a fully sorted
+    copy of the table is never held in memory.
+    """
+    for start in range(0, len(order), batch_rows):
+        yield from table.take(order[start:start + batch_rows]).to_batches()
+
+def write_combined_csv(table, order):
+    """
+    Writes the rows of 'table', in the order given by 'order', to the combined
+    CSV file. Arrow's CSV format differs from the pandas to_csv output this file
+    used to have: whole-number floats are written without a decimal part (43,
+    not 43.0), and every value of a string column is quoted ("x"), not only
+    values containing a comma, quote or newline. Dates, times and numbers are
+    never quoted.
+    """
+    csv_options = pcsv.WriteOptions(include_header=False)
+    with open(COMBINED_CSV, 'wb') as csv_file, \
+            pcsv.CSVWriter(csv_file, table.schema, write_options=csv_options) as csv_writer:
+        # Arrow always quotes header fields, so write a plain one ourselves
+        csv_file.write((','.join(table.column_names) + '\n').encode())
+        for batch in sorted_batches(table, order):
+            csv_writer.write_batch(batch)
+
+def write_combined_parquet(table, order):
+    """
+    Writes the rows of 'table', in the order given by 'order', to the combined
+    Parquet dataset. Only the days present in 'table' are replaced; the files
+    of every other day are left as they are.
+    """
+    ds.write_dataset(sorted_batches(table, order), COMBINED_PARQUET, schema=table.schema,
+                     format='parquet', partitioning=PARTITIONING,
+                     file_options=ds.ParquetFileFormat().make_write_options(compression='zstd', use_dictionary=True),
+                     basename_template='part-{i}.parquet',
+                     existing_data_behavior='delete_matching', preserve_order=True)
+
+def read_combined(dates=None):
+    """
+    Reads the combined data written by earlier runs from its Parquet dataset,
+    limited to the days in 'dates' if given.
+    """
+    dataset = ds.dataset(COMBINED_PARQUET, format='parquet', partitioning=PARTITIONING)
+    # Days written by different runs may have different columns, so read them
+    # all with a unified schema. Known columns get the same types the CSV reader
+    # produces; this also undoes Parquet storing 'time' with millisecond
+    # resolution and widens nothing that older runs wrote as float64.
+    schema = pa.unify_schemas([f.physical_schema for f in dataset.get_fragments()], promote_options="permissive")
+    schema = pa.schema([pa.field('date', pa.date32())] +
+                       [pa.field(f.name, COLUMN_TYPES.get(f.name, f.type)) for f in schema])
+    dataset = ds.dataset(COMBINED_PARQUET, format='parquet', partitioning=PARTITIONING, schema=schema)
+    return dataset.to_table(filter=None if dates is None else pc.field('date').isin(dates))
+
+def load_manifest():
+    """Returns the manifest written by the last merge, or None if there isn't a usable one."""
+    try:
+        with open(MANIFEST_PATH) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError) as e:
+        print(f"Ignoring unreadable merge manifest {MANIFEST_PATH}: {e}")
+        return None
+
+def file_fingerprint(filepath):
+    """Returns a hash of a file's contents, used to tell whether it changed since the last merge."""
+    digest = hashlib.sha1()
+    with open(filepath, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+def save_manifest(fingerprints, combined_rows):
+    """Atomically records the merged files with their content hashes and the combined row count."""
+    manifest = {
+        'files': fingerprints,
+        'combined_rows': combined_rows,
+    }
+    tmp_path = MANIFEST_PATH + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+        f.write('\n')
+    os.replace(tmp_path, MANIFEST_PATH)
+
+def read_sensor_files(files):
+    """
+    Reads sensor CSVs into a list of distinct-row Arrow tables, skipping
+    unreadable files. Returns the tables and the list of files that were parsed.
+    """
+    # Group files by header: the ESP32 writes a fixed layout, so most files
+    # share one and are parsed together in a single pass
+    groups = {}
+    for file in files:
+        groups.setdefault(read_header(file), []).append(file)
+
+    # Read the groups concurrently; the Arrow parser releases the GIL
+    tables, parsed_files = [], []
+    with ThreadPoolExecutor(max_workers=min(32, len(groups))) as executor:
+        for table, group_parsed in executor.map(read_sensor_group, groups.values()):
+            if table is not None:
+                tables.append(table)
+            parsed_files.extend(group_parsed)
+    return tables, parsed_files
+
+def combine_tables(tables):
+    """
+    Concatenates distinct-row tables into one, or returns None if there are no
+    tables. Older files carry a different set of columns, so missing columns
+    are filled with nulls.
+    """
+    if not tables:
+        print("No valid data found")
+        return None
+    return pa.concat_tables(tables, promote_options="permissive")
+
 def merge_sensor_files():
-    # Find all sensor data files
-    files = sorted(glob.glob('data/sensor_*.csv'))
+    # Find all sensor data files. A full merge also reads the previous
+    # combined CSV, which holds rows from files that have since been cleaned up.
+    sensor_files = [e.path for e in list_sensor_files()]
+    files = sensor_files + ([COMBINED_CSV] if os.path.exists(COMBINED_CSV) else [])
 
     if not files:
         print("No sensor files found")
         return False
 
-    # Read and combine all files
-    dfs = []
-    for file in files:
+    # If the last run left its result and manifest behind, only files added or
+    # changed since then need reading. Contents are hashed rather than mtimes
+    # compared because a fresh checkout gives every file a new mtime; hashing
+    # still reads far less than parsing every file.
+    fingerprints = {os.path.basename(f): file_fingerprint(f) for f in sensor_files}
+    files_to_read = files
+    incremental = False
+    manifest = load_manifest()
+    if manifest is not None and os.path.isdir(COMBINED_PARQUET):
+        merged = manifest.get('files', {})
+        new_files = [f for f in sensor_files if merged.get(os.path.basename(f)) != fingerprints[os.path.basename(f)]]
+        if not new_files:
+            print("No new sensor files since the last merge")
+            cleanup_sensor_files_by_count(files_to_keep=100)
+            return True
+        files_to_read = new_files
+        incremental = True
+        print(f"Merging {len(new_files)} new sensor files into the existing combined data")
+
+    # The concat shares the tables' buffers, but any column that had to be
+    # filled or cast is a copy, so drop the per-file tables right away rather
+    # than keep them alive through the merge.
+    tables, parsed_files = read_sensor_files(files_to_read)
+    combined = combine_tables(tables)
+    del tables
+    if combined is None:
+        if incremental:
+            # The existing combined data is still intact
+            cleanup_sensor_files_by_count(files_to_keep=100)
+        return incremental
+
+    # Only the days the new rows fall on are rewritten, so merge the new rows
+    # with just those days of the existing data
+    if incremental:
         try:
-            df = pd.read_csv(file)
-            dfs.append(df)
+            existing = read_combined(dates=pc.unique(combined['date']))
+            combined = pa.concat_tables([existing, combined], promote_options="permissive")
+            del existing
         except Exception as e:
-            print(f"Error reading {file}: {e}")
+            print(f"Error reading {COMBINED_PARQUET}, merging all files: {e}")
+            incremental = False
+            files_to_read = files
+            tables, parsed_files = read_sensor_files(files)
+            combined = combine_tables(tables)
+            del tables
+            if combined is None:
+                return False
 
-    if not dfs:
-        print("No valid data found")
-        return False
-
-    # Combine and deduplicate
-    combined = pd.concat(dfs, ignore_index=True)
-    combined.drop_duplicates(inplace=True)
-    combined.sort_values(by=['timestamp'], inplace=True)
+    # Deduplicate and sort in one pass. Each table is already distinct, so
+    # this only removes rows repeated across tables. The rows themselves are
+    # gathered batch by batch while writing.
+    order = sorted_distinct_indices(combined)
 
-    # Save merged file
+    # Save merged data: Parquet is the canonical columnar copy, the CSV is kept
+    # for humans and existing consumers
     os.makedirs('data', exist_ok=True)
-    combined.to_csv('data/sensor_data_combined.csv', index=False)
+    write_combined_parquet(combined, order)
+    if incremental:
+        # The CSV holds every day, so rebuild it from the updated dataset,
+        # releasing the merged days first
+        del combined, order
+        combined = read_combined()
+        order = sorted_distinct_indices(combined)
+    write_combined_csv(combined, order)
+    # Record only files whose rows are now in the combined data: the ones
+    # parsed this run, plus unchanged ones merged earlier. Files that failed
+    # to parse are retried on the next run.
+    merged_files = {os.path.basename(f) for f in parsed_files}
+    merged_files.update(os.path.basename(f) for f in sensor_files if f not in files_to_read)
+    save_manifest({name: fp for name, fp in fingerprints.items() if name in merged_files}, len(order))
 
     # After merging and saving the combined file, clean up individual sensor files
     # Keep only the newest 100 files
@@ -151,18 +577,18 @@ if __name__ == "__main__":
         print("Merge completed successfully")
         # Attempt to commit and push changes including deletions
         try:
-            subprocess.run(["git", "config", "--global", "user.name", "\"GitHub Actions\""], check=True)
-            subprocess.run(["git", "config", "--global", "user.email", "\"actions@github.com\""], check=True)
-
-            # Stage all changes in the data/ directory (including deleted files and the combined CSV)
-            subprocess.run(["git", "add", "data/"], check=True)
-
-            # Commit only if there are actual changes
-            commit_result = subprocess.run(["git", "commit", "-m", "Cleaned up old sensor files and updated combined data [skip ci]"], capture_output=True, text=True, check=False)
+            # Check for changes in data/ first so the common no-op run costs one git call
+            status = subprocess.run(["git", "status", "--porcelain", "data/"], capture_output=True, text=True, check=True, env=GIT_ENV)
 
-            if "nothing to commit" not in commit_result.stdout and "no changes added to commit" not in commit_result.stderr:
+            if status.stdout.strip():
+                # Stage all changes in the data/ directory (including deleted files, new
+                # files and the combined outputs); 'commit -a' alone would miss untracked ones
+                subprocess.run(["git", "add", "data/"], check=True, env=GIT_ENV)
+                commit_result = subprocess.run(["git", "-c", "user.name=GitHub Actions", "-c", "user.email=actions@github.com",
+                                                "commit", "-m", "Cleaned up old sensor files and updated combined data [skip ci]"],
+                                               capture_output=True, text=True, check=True, env=GIT_ENV)
                 print("Changes committed:", commit_result.stdout.strip())
-                subprocess.run(["git", "push"], check=True)
+                subprocess.run(["git", "push"], check=True, env=GIT_ENV)
                 print("Deletion and merge changes pushed to repository.")
             else:
                 print("No changes to commit or push (either no old files to delete or no new data).")